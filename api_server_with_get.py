@@ -3,58 +3,218 @@
 API Server with JSONBin.io Storage
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, make_response
 from datetime import datetime
-import json
+from functools import wraps
+import fcntl
+import hashlib
+import hmac
+import io
 import os
+import threading
+import time
+import zlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from werkzeug.wsgi import get_input_stream
+import orjson
+
+try:
+    import redis
+except ImportError:
+    redis = None
 
 app = Flask(__name__)
 
 # Configuration
 API_KEY = os.getenv('API_KEY', 'your-secret-api-key-here')
+API_KEY_BYTES = API_KEY.encode('utf-8')
 JSONBIN_API_KEY = os.getenv('JSONBIN_API_KEY')
 JSONBIN_BIN_ID = os.getenv('JSONBIN_BIN_ID')
+CACHE_TTL = float(os.getenv('CACHE_TTL', '30'))
+REFRESH_BACKOFF = 5  # Seconds between upstream retries after a failed refresh
+MAX_BODY_SIZE = 1024 * 1024  # Upper bound on a decompressed POST body
+REDIS_URL = os.getenv('REDIS_URL')
+# Outlive the daily extractor run, with a day's margin for a missed run
+REDIS_TTL = int(os.getenv('REDIS_TTL', str(2 * 24 * 3600)))
+JSONBIN_PUT_ATTEMPTS = 3
+CACHE_KEY_PREFIX = os.getenv('CACHE_KEY_PREFIX', 'dominion_')
+SCHEDULE_KEY = f'{CACHE_KEY_PREFIX}schedule'
+
+# Run the extractor on a daily cron inside the server (requires APScheduler).
+# Only the worker holding EXTRACTOR_LOCK schedules it, so other gunicorn
+# workers on the host don't run it again.
+EMBED_EXTRACTOR = os.getenv('EMBED_EXTRACTOR', '').lower() in ('1', 'true', 'yes')
+EXTRACTOR_HOUR = int(os.getenv('EXTRACTOR_HOUR', '17'))
+EXTRACTOR_MINUTE = int(os.getenv('EXTRACTOR_MINUTE', '5'))
+EXTRACTOR_TZ = os.getenv('EXTRACTOR_TZ', 'America/New_York')
+EXTRACTOR_LOCK = os.getenv('EXTRACTOR_LOCK', '/tmp/dominion_extractor.lock')
+
+# Optional shared cache in front of JSONBin, used when REDIS_URL is set
+redis_client = redis.Redis.from_url(REDIS_URL) if redis is not None and REDIS_URL else None
+if REDIS_URL and redis is None:
+    print("⚠ REDIS_URL is set but the redis package is not installed; using JSONBin only")
+
+# In-process cache of the last schedule read from (or written to) JSONBin
+_cache = {'data': None, 'ts': 0.0, 'error': None, 'retry_at': 0.0}
+_cache_lock = threading.Lock()
+
+# Signature of the last schedule confirmed stored in JSONBin, used to skip
+# re-saving an identical payload
+_last_sig = None
+UNSIGNED_FIELDS = ('fetched_at', 'received_at')
+
+# Deferred JSONBin writes behind Redis go through a single writer thread,
+# which only ever holds the latest pending schedule
+_jsonbin_queue = {'data': None, 'sig': None}
+_jsonbin_cond = threading.Condition()
+_jsonbin_writer = None
+
+# Shared session so JSONBin calls reuse pooled keep-alive connections
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+))
+
+# Serialized GET response bodies, keyed on endpoint, data version and query
+_body_cache = {}
+_BODY_CACHE_SIZE = 32
+
+# Clients and edge caches may reuse a GET response for this many seconds
+CACHE_CONTROL = 'public, max-age=60'
+
+# Open file holding EXTRACTOR_LOCK while this process runs the scheduler
+_extractor_lock = None
+
+# Precomputed /api/designation answer, the most frequently polled endpoint
+_letter_cache = {'val': b'NONE', 'ts': None}
+LETTER_TTL = 30
+
+
+def _cache_fresh():
+    return _cache['data'] is not None and time.monotonic() - _cache['ts'] < CACHE_TTL
+
+
+def _set_cache(data):
+    _cache['data'] = data
+    _cache['ts'] = time.monotonic()
+
+
+def _schedule_signature(data):
+    """Hash the whole schedule payload, ignoring its timestamps"""
+    significant = {k: v for k, v in data.items() if k not in UNSIGNED_FIELDS}
+    return hashlib.blake2b(orjson.dumps(significant, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+
+def _prime_signature(record):
+    """Adopt the signature of a schedule read back from JSONBin"""
+    global _last_sig
+    if _last_sig is None and 'upcoming_schedule' in record:
+        _last_sig = _schedule_signature(record)
 
 
 def load_schedule():
-    """Load the latest schedule from JSONBin.io"""
+    """Load the latest schedule, served from memory for CACHE_TTL seconds"""
     if not JSONBIN_API_KEY or not JSONBIN_BIN_ID:
         return {'error': 'JSONBin not configured'}
     
+    if _cache_fresh():
+        return _cache['data']
+    
+    if _cache['data'] is not None:
+        # Serve the stale copy rather than queue behind another thread's refresh
+        if not _cache_lock.acquire(blocking=False):
+            return _cache['data']
+    else:
+        _cache_lock.acquire()
+    
+    try:
+        # Another thread may have refreshed while we waited for the lock
+        if _cache_fresh():
+            return _cache['data']
+        # A refresh just failed with nothing cached; don't hit upstream again yet
+        if time.monotonic() < _cache['retry_at']:
+            return _cache['error']
+        return _fetch_schedule()
+    finally:
+        _cache_lock.release()
+
+
+def _read_redis():
+    """Return the schedule stored in Redis, or None on a miss or error"""
+    if redis_client is None:
+        return None
+    
+    try:
+        raw = redis_client.get(SCHEDULE_KEY)
+        return orjson.loads(raw) if raw is not None else None
+    except Exception as e:
+        print(f"Error reading from Redis: {e}")
+        return None
+
+
+def _write_redis(data):
+    """Store the schedule in Redis, returning True on success"""
+    if redis_client is None:
+        return False
+    
+    try:
+        redis_client.set(SCHEDULE_KEY, orjson.dumps(data), ex=REDIS_TTL)
+        return True
+    except Exception as e:
+        print(f"Error writing to Redis: {e}")
+        return False
+
+
+def _fetch_schedule():
+    """Fetch the latest schedule from Redis or JSONBin.io and refresh the cache"""
+    record = _read_redis()
+    if record is not None:
+        _set_cache(record)
+        return record
+    
     try:
         url = f'https://api.jsonbin.io/v3/b/{JSONBIN_BIN_ID}/latest'
         headers = {
             'X-Access-Key': JSONBIN_API_KEY
         }
         
-        response = requests.get(url, headers=headers, timeout=10)
+        response = SESSION.get(url, headers=headers, timeout=10)
         response.raise_for_status()
         
-        data = response.json()
-        return data.get('record', {})
+        data = orjson.loads(response.content)
+        record = data.get('record', {})
+        _write_redis(record)
+        _prime_signature(record)
+        _set_cache(record)
+        return record
         
     except Exception as e:
         print(f"Error loading from JSONBin: {e}")
-        return {'error': 'Failed to load data', 'message': str(e)}
+        
+        if _cache['data'] is not None:
+            # Keep serving the last good schedule and retry after a short backoff
+            _cache['ts'] = time.monotonic() - CACHE_TTL + REFRESH_BACKOFF
+            return _cache['data']
+        
+        _cache['error'] = {'error': 'Failed to load data', 'message': str(e)}
+        _cache['retry_at'] = time.monotonic() + REFRESH_BACKOFF
+        return _cache['error']
 
 
-def save_schedule(data):
-    """Save schedule to JSONBin.io"""
-    if not JSONBIN_API_KEY or not JSONBIN_BIN_ID:
-        print("JSONBin not configured")
-        return False
-    
+def _put_jsonbin(data):
+    """Write schedule to JSONBin.io, returning True on success"""
     try:
-        data['received_at'] = datetime.now().isoformat()
-        
         url = f'https://api.jsonbin.io/v3/b/{JSONBIN_BIN_ID}'
         headers = {
             'Content-Type': 'application/json',
             'X-Access-Key': JSONBIN_API_KEY
         }
         
-        response = requests.put(url, json=data, headers=headers, timeout=10)
+        response = SESSION.put(url, data=orjson.dumps(data), headers=headers, timeout=10)
         response.raise_for_status()
         
         print("✓ Data saved to JSONBin")
@@ -65,13 +225,182 @@ def save_schedule(data):
         return False
 
 
+def _superseded(data):
+    """True once a newer schedule is saved or queued behind this one"""
+    return _jsonbin_queue['data'] is not None or _cache['data'] is not data
+
+
+def _put_jsonbin_background(data, sig):
+    """Deferred JSONBin write behind Redis, retried with backoff"""
+    global _last_sig
+    
+    for attempt in range(1, JSONBIN_PUT_ATTEMPTS + 1):
+        if _put_jsonbin(data):
+            with _cache_lock:
+                # A newer save may have replaced this one in the meantime
+                if _cache['data'] is data:
+                    _last_sig = sig
+            return True
+        
+        if attempt < JSONBIN_PUT_ATTEMPTS:
+            with _jsonbin_cond:
+                # Back off, but wake early if a newer schedule arrives
+                _jsonbin_cond.wait_for(lambda: _superseded(data), timeout=2 ** attempt)
+            if _superseded(data):
+                # Retrying would overwrite the newer schedule with this one
+                print("JSONBin retry dropped: a newer schedule has been saved")
+                return False
+    
+    print(f"✗✗ JSONBin write failed after {JSONBIN_PUT_ATTEMPTS} attempts: "
+          f"schedule received at {data.get('received_at')} exists only in Redis "
+          f"and will be lost when the key expires")
+    return False
+
+
+def _jsonbin_writer_loop():
+    """Write queued schedules to JSONBin one at a time, keeping only the latest"""
+    while True:
+        with _jsonbin_cond:
+            _jsonbin_cond.wait_for(lambda: _jsonbin_queue['data'] is not None)
+            data, sig = _jsonbin_queue['data'], _jsonbin_queue['sig']
+            _jsonbin_queue['data'] = None
+        _put_jsonbin_background(data, sig)
+
+
+def _queue_jsonbin_write(data, sig):
+    """Hand a schedule to the background JSONBin writer, replacing any pending one"""
+    global _jsonbin_writer
+    
+    with _jsonbin_cond:
+        _jsonbin_queue['data'] = data
+        _jsonbin_queue['sig'] = sig
+        if _jsonbin_writer is None:
+            _jsonbin_writer = threading.Thread(target=_jsonbin_writer_loop, daemon=True)
+            _jsonbin_writer.start()
+        _jsonbin_cond.notify_all()
+
+
+def save_schedule(data):
+    """Save schedule to Redis (when configured) and JSONBin.io"""
+    global _last_sig
+    
+    if not JSONBIN_API_KEY or not JSONBIN_BIN_ID:
+        print("JSONBin not configured")
+        return False
+    
+    sig = _schedule_signature(data)
+    if sig == _last_sig:
+        # Identical to what JSONBin already holds; keep that record as is
+        print("✓ Schedule unchanged, skipped write")
+        return True
+    
+    data['received_at'] = datetime.now().isoformat()
+    
+    if _write_redis(data):
+        with _cache_lock:
+            _set_cache(data)
+            # Recorded by the background write once JSONBin confirms it
+            _last_sig = None
+        # Redis now serves reads, so JSONBin only needs to catch up eventually
+        _queue_jsonbin_write(data, sig)
+    elif _put_jsonbin(data):
+        with _cache_lock:
+            _set_cache(data)
+            _last_sig = sig
+    else:
+        return False
+    
+    _body_cache.clear()
+    _letter_cache['ts'] = None
+    return True
+
+
+def ojson(obj, code=200):
+    """JSON response serialized with orjson"""
+    return app.response_class(orjson.dumps(obj), status=code, mimetype='application/json')
+
+
+def _response_key(data):
+    """Identify a GET response by endpoint, data version, date and query"""
+    return (
+        request.endpoint,
+        data.get('received_at', ''),
+        datetime.now().date().isoformat(),
+        tuple(sorted(request.args.items()))
+    )
+
+
+def cached_json(data, build):
+    """Return a JSON response, reusing the serialized body while data is unchanged"""
+    key = _response_key(data)
+    
+    body = _body_cache.get(key)
+    if body is None:
+        body = orjson.dumps(build())
+        if len(_body_cache) >= _BODY_CACHE_SIZE:
+            _body_cache.clear()
+        _body_cache[key] = body
+    
+    return Response(body, mimetype='application/json')
+
+
+def etag_cached(view):
+    """Load the schedule once, pass it to the view and answer If-None-Match with 304"""
+    @wraps(view)
+    def wrapper():
+        data = load_schedule()
+        
+        if 'error' in data or data.get('status') == 'no_data':
+            return view(data)
+        
+        etag = hashlib.md5(repr(_response_key(data)).encode('utf-8')).hexdigest()
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = make_response(view(data))
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return response
+    
+    return wrapper
+
+
+@app.before_request
+def decompress_request_body():
+    """Transparently inflate gzip-encoded request bodies before request.json"""
+    environ = request.environ
+    if environ.get('HTTP_CONTENT_ENCODING', '').lower() != 'gzip':
+        return None
+    
+    # Inflate incrementally so a small body can't expand without bound
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        raw = get_input_stream(environ, max_content_length=MAX_BODY_SIZE).read()
+        body = inflater.decompress(raw, MAX_BODY_SIZE)
+    except zlib.error:
+        return jsonify({'error': 'Invalid gzip body'}), 400
+    
+    if inflater.unconsumed_tail:
+        return jsonify({'error': 'Request body too large'}), 413
+    
+    # Hand Flask the plain body as if it had been sent uncompressed
+    environ['wsgi.input'] = io.BytesIO(body)
+    environ['CONTENT_LENGTH'] = str(len(body))
+    del environ['HTTP_CONTENT_ENCODING']
+    return None
+
+
 @app.route('/dominion-schedule', methods=['POST'])
 def receive_schedule():
     """POST endpoint - receives schedule data"""
     
     # Verify API key
     auth_header = request.headers.get('Authorization', '')
-    if not auth_header.startswith('Bearer ') or auth_header[7:] != API_KEY:
+    token = auth_header[7:].encode('utf-8') if auth_header.startswith('Bearer ') else b''
+    if not hmac.compare_digest(token, API_KEY_BYTES):
         return jsonify({'error': 'Unauthorized'}), 401
     
     try:
@@ -111,101 +440,120 @@ def receive_schedule():
 @app.route('/api/designation', methods=['GET'])
 def get_designation_only():
     """Returns just the letter: A, B, or C"""
-    data = load_schedule()
-    
-    if 'error' in data or data.get('status') == 'no_data':
-        return "ERROR", 404
-    
-    next_des = data.get('next_designation')
-    if not next_des:
-        return "NONE", 404
+    if _letter_cache['ts'] is None or time.monotonic() - _letter_cache['ts'] >= LETTER_TTL:
+        data = load_schedule()
+        
+        if 'error' in data or data.get('status') == 'no_data':
+            return Response(b'ERROR', status=404, mimetype='text/plain')
+        
+        next_des = data.get('next_designation')
+        _letter_cache['val'] = next_des['designation'].encode('ascii') if next_des else b'NONE'
+        _letter_cache['ts'] = time.monotonic()
     
-    return next_des['designation'], 200
+    letter = _letter_cache['val']
+    return Response(letter, status=200 if letter in (b'A', b'B', b'C') else 404, mimetype='text/plain')
 
 
 @app.route('/api/next', methods=['GET'])
-def get_next_designation():
+@etag_cached
+def get_next_designation(data):
     """Returns next designation with details"""
-    data = load_schedule()
-    
     if 'error' in data or data.get('status') == 'no_data':
-        return jsonify({'error': 'No data available'}), 404
+        return ojson({'error': 'No data available'}, 404)
     
     next_des = data.get('next_designation')
     if not next_des:
-        return jsonify({'error': 'No upcoming designation found'}), 404
+        return ojson({'error': 'No upcoming designation found'}, 404)
     
-    return jsonify({
+    return cached_json(data, lambda: {
         'designation': next_des['designation'],
         'date': next_des['date'],
         'day': next_des['day'],
         'timestamp': next_des['timestamp'],
         'fetched_at': data.get('fetched_at'),
         'received_at': data.get('received_at')
-    }), 200
+    })
 
 
 @app.route('/api/today', methods=['GET'])
-def get_today_designation():
+@etag_cached
+def get_today_designation(data):
     """Returns today's designation"""
-    data = load_schedule()
-    
     if 'error' in data or data.get('status') == 'no_data':
-        return jsonify({'error': 'No data available'}), 404
+        return ojson({'error': 'No data available'}, 404)
     
     today = datetime.now().date().isoformat()
-    upcoming = data.get('upcoming_schedule', [])
     
-    for entry in upcoming:
-        if entry['date'] == today:
-            return jsonify({
-                'date': entry['date'],
-                'designation': entry['designation'],
-                'day': entry['day'],
-                'is_today': True
-            }), 200
+    # The extractor precomputes today/tomorrow; either matches the current
+    # date depending on whether it last ran today or yesterday
+    entry = None
+    for key in ('today_designation', 'tomorrow_designation'):
+        candidate = data.get(key)
+        if candidate and candidate['date'] == today:
+            entry = candidate
+            break
+    
+    if entry is None:
+        if 'by_date' in data:
+            entry = data['by_date'].get(today)
+        else:
+            # Data stored before the extractor started writing by_date
+            entry = next((e for e in data.get('upcoming_schedule', []) if e['date'] == today), None)
     
-    return jsonify({'error': 'No designation for today'}), 404
+    if not entry:
+        return ojson({'error': 'No designation for today'}, 404)
+    
+    return cached_json(data, lambda: {
+        'date': entry['date'],
+        'designation': entry['designation'],
+        'day': entry['day'],
+        'is_today': True
+    })
 
 
 @app.route('/api/upcoming', methods=['GET'])
-def get_upcoming_days():
+@etag_cached
+def get_upcoming_days(data):
     """Returns upcoming schedule"""
-    data = load_schedule()
-    
     if 'error' in data or data.get('status') == 'no_data':
-        return jsonify({'error': 'No data available'}), 404
+        return ojson({'error': 'No data available'}, 404)
     
+    return cached_json(data, lambda: _build_upcoming(data))
+
+
+def _build_upcoming(data):
     upcoming = data.get('upcoming_schedule', [])
     
     limit = request.args.get('limit', type=int)
     designation_filter = request.args.get('designation', '').upper()
     
     if designation_filter and designation_filter in ['A', 'B', 'C']:
-        upcoming = [e for e in upcoming if e['designation'] == designation_filter]
+        if 'by_designation' in data:
+            upcoming = data['by_designation'].get(designation_filter, [])
+        else:
+            upcoming = [e for e in upcoming if e['designation'] == designation_filter]
     
     if limit and limit > 0:
         upcoming = upcoming[:limit]
     
-    return jsonify({
+    return {
         'upcoming': upcoming,
         'count': len(upcoming),
         'total_available': len(data.get('upcoming_schedule', []))
-    }), 200
+    }
 
 
 @app.route('/api/summary', methods=['GET'])
-def get_summary():
+@etag_cached
+def get_summary(data):
     """Returns summary statistics"""
-    data = load_schedule()
-    
     if 'error' in data or data.get('status') == 'no_data':
-        return jsonify({'error': 'No data available'}), 404
+        return ojson({'error': 'No data available'}, 404)
     
     summary = data.get('summary', {})
     next_des = data.get('next_designation', {})
     
-    return jsonify({
+    return cached_json(data, lambda: {
         'total_upcoming': summary.get('total_upcoming', 0),
         'A_count': summary.get('A_count', 0),
         'B_count': summary.get('B_count', 0),
@@ -214,7 +562,7 @@ def get_summary():
         'next_date': next_des.get('date') if next_des else None,
         'fetched_at': data.get('fetched_at'),
         'received_at': data.get('received_at')
-    }), 200
+    })
 
 
 @app.route('/health', methods=['GET'])
@@ -222,13 +570,13 @@ def health_check():
     """Health check endpoint"""
     data = load_schedule()
     
-    return jsonify({
+    return ojson({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'has_data': 'next_designation' in data and data.get('status') != 'no_data',
         'last_update': data.get('received_at', 'never'),
         'storage': 'jsonbin.io'
-    }), 200
+    })
 
 
 @app.route('/', methods=['GET'])
@@ -246,12 +594,60 @@ def index():
             'GET /api/summary': 'Returns summary statistics',
             'POST /dominion-schedule': 'Receives data from extractor (requires API key)',
             'GET /health': 'Health check'
+        },
+        'schedule_fields': {
+            'next_designation': 'First entry on or after the extraction date',
+            'today_designation': 'Entry for the extraction date, if any',
+            'tomorrow_designation': 'Entry for the day after extraction, if any',
+            'upcoming_schedule': 'Entries within DAYS_AHEAD of extraction',
+            'by_date': 'upcoming_schedule keyed by YYYY-MM-DD',
+            'by_designation': 'upcoming_schedule grouped by letter (A, B, C)',
+            'summary': 'Counts of upcoming entries per letter'
         }
     }), 200
 
 
+def start_scheduler():
+    """Schedule the extractor to save straight into this process's cache"""
+    global _extractor_lock
+    
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from dominion_energy_extractor_render import DominionEnergyExtractor
+    
+    # Held for the life of the process; released by the OS if the worker dies
+    lock_file = open(EXTRACTOR_LOCK, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        print("Extractor already scheduled by another worker")
+        return None
+    _extractor_lock = lock_file
+    
+    extractor = DominionEnergyExtractor(save=save_schedule)
+    scheduler = BackgroundScheduler(timezone=EXTRACTOR_TZ)
+    scheduler.add_job(extractor.run, 'cron', hour=EXTRACTOR_HOUR, minute=EXTRACTOR_MINUTE)
+    scheduler.start()
+    
+    print(f"✓ Extractor scheduled daily at {EXTRACTOR_HOUR:02d}:{EXTRACTOR_MINUTE:02d} {EXTRACTOR_TZ}")
+    return scheduler
+
+
+if EMBED_EXTRACTOR:
+    scheduler = start_scheduler()
+
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
+    
+    # Production runs under gunicorn (see Procfile); the Werkzeug server
+    # handles one request at a time and is only meant for local testing.
+    if not os.getenv('USE_DEV_SERVER'):
+        print("Run with gunicorn, e.g.:")
+        print(f"  gunicorn -w 2 -k gthread --threads 8 --timeout 30 -b 0.0.0.0:{port} api_server_with_get:app")
+        print("or set USE_DEV_SERVER=1 to use the Flask development server.")
+        raise SystemExit(1)
+    
     print("=== Dominion Energy API with JSONBin.io ===")
     print(f"Storage: JSONBin.io")
     print(f"Port: {port}\n")
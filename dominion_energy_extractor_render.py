@@ -5,24 +5,51 @@ Uses environment variables for configuration
 """
 
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import gzip
+import orjson
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from typing import Callable, Optional, Dict, List
 import sys
 
+# (connect, read) timeouts in seconds: fail fast on an unreachable host
+REQUEST_TIMEOUT = (3.05, 10)
+
 
 class DominionEnergyExtractor:
-    def __init__(self):
+    def __init__(self, save: Optional[Callable[[Dict], bool]] = None):
         """
         Initialize the extractor with environment variables
+        
+        When running inside the API server, pass its save_schedule as
+        `save` to store the payload directly instead of POSTing it.
         """
+        self.save = save
         self.api_endpoint = os.getenv('API_ENDPOINT')
         self.api_key = os.getenv('API_KEY')
         self.days_ahead = int(os.getenv('DAYS_AHEAD', '7'))
         self.base_url = "https://www.dominionenergy.com/api/sched10/years/{year}/months/{month}"
         
-        print(f"Initialized with API endpoint: {self.api_endpoint or 'None (test mode)'}")
+        # Reuse connections across the monthly fetches and the publish call,
+        # retrying transient failures (including the POST, which just overwrites)
+        retry = Retry(
+            total=3,
+            connect=3,
+            backoff_factor=0.3,
+            status_forcelist=[500, 502, 503, 504],
+            allowed_methods=['GET', 'POST', 'PUT']
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+        self.session.mount('http://', HTTPAdapter(max_retries=retry))
+        
+        if save is not None:
+            print("Initialized in-process with the API server")
+        else:
+            print(f"Initialized with API endpoint: {self.api_endpoint or 'None (test mode)'}")
     
     def get_dominion_data(self, year: int, month: str) -> Dict:
         """
@@ -31,9 +58,9 @@ class DominionEnergyExtractor:
         url = self.base_url.format(year=year, month=month)
         
         try:
-            response = requests.get(url, timeout=10)
+            response = self.session.get(url, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching data from Dominion Energy: {e}")
             raise
@@ -84,19 +111,6 @@ class DominionEnergyExtractor:
         
         return sorted(schedule, key=lambda x: x['date'])
     
-    def get_next_designation(self, schedule: List[Dict]) -> Optional[Dict]:
-        """
-        Get the designation for the next upcoming date
-        """
-        today = datetime.now().date()
-        
-        for entry in schedule:
-            entry_date = datetime.fromisoformat(entry['timestamp']).date()
-            if entry_date >= today:
-                return entry
-        
-        return None
-    
     def publish_to_api(self, data: Dict) -> bool:
         """
         Publish extracted data to your API endpoint
@@ -106,18 +120,19 @@ class DominionEnergyExtractor:
             return False
         
         headers = {
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip'
         }
         
         if self.api_key:
             headers['Authorization'] = f'Bearer {self.api_key}'
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.api_endpoint,
-                json=data,
+                data=gzip.compress(orjson.dumps(data)),
                 headers=headers,
-                timeout=10
+                timeout=REQUEST_TIMEOUT
             )
             response.raise_for_status()
             print(f"✓ Successfully published data to API: {response.status_code}")
@@ -137,33 +152,54 @@ class DominionEnergyExtractor:
         print(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] Fetching data for {current_month} {current_year}...")
         
         try:
-            # Fetch current month data
-            data = self.get_dominion_data(current_year, current_month)
-            schedule = self.extract_schedule_data(data)
+            next_month_date = now.replace(day=28) + timedelta(days=4)
+            next_month = next_month_date.strftime('%B')
+            next_year = next_month_date.year
             
-            # Check if we need next month's data
+            today_iso = now.date().isoformat()
             end_date = (now + timedelta(days=self.days_ahead)).date()
-            last_schedule_date = datetime.fromisoformat(schedule[-1]['timestamp']).date() if schedule else now.date()
+            end_iso = end_date.isoformat()
             
-            if end_date > last_schedule_date:
-                next_month_date = now.replace(day=28) + timedelta(days=4)
-                next_month = next_month_date.strftime('%B')
-                next_year = next_month_date.year
+            # Fetch next month alongside the current one when the window crosses into it
+            next_future = None
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                current_future = executor.submit(self.get_dominion_data, current_year, current_month)
+                if (end_date.year, end_date.month) != (now.year, now.month):
+                    print(f"Fetching data for {next_month} {next_year}...")
+                    next_future = executor.submit(self.get_dominion_data, next_year, next_month)
+                
+                data = current_future.result()
+                schedule = self.extract_schedule_data(data)
                 
-                print(f"Fetching data for {next_month} {next_year}...")
-                next_data = self.get_dominion_data(next_year, next_month)
-                next_schedule = self.extract_schedule_data(next_data)
-                schedule.extend(next_schedule)
+                # Fall back to a direct fetch if the current month's data ends early
+                last_schedule_iso = schedule[-1]['date'] if schedule else today_iso
+                if next_future is None and end_iso > last_schedule_iso:
+                    print(f"Fetching data for {next_month} {next_year}...")
+                    next_future = executor.submit(self.get_dominion_data, next_year, next_month)
+                
+                if next_future is not None:
+                    next_data = next_future.result()
+                    next_schedule = self.extract_schedule_data(next_data)
+                    schedule.extend(next_schedule)
             
-            # Get upcoming schedule
+            # Collect the upcoming window, its indexes and the next
+            # designation in one pass over the (date-sorted) schedule;
+            # ISO 'YYYY-MM-DD' strings sort the same as the dates they encode
             upcoming_schedule = []
-            for entry in schedule:
-                entry_date = datetime.fromisoformat(entry['timestamp']).date()
-                if now.date() <= entry_date <= end_date:
-                    upcoming_schedule.append(entry)
+            by_date = {}
+            by_designation = {'A': [], 'B': [], 'C': []}
+            next_entry = None
             
-            # Get next designation
-            next_entry = self.get_next_designation(schedule)
+            for entry in schedule:
+                if entry['date'] < today_iso:
+                    continue
+                if next_entry is None:
+                    next_entry = entry
+                if entry['date'] > end_iso:
+                    break
+                upcoming_schedule.append(entry)
+                by_date[entry['date']] = entry
+                by_designation[entry['designation']].append(entry)
             
             if not next_entry:
                 print("Warning: No upcoming designation found!")
@@ -173,11 +209,17 @@ class DominionEnergyExtractor:
                 'fetched_at': now.isoformat(),
                 'next_designation': next_entry,
                 'upcoming_schedule': upcoming_schedule,
+                # Indexes so the API can answer lookups without scanning
+                'by_date': by_date,
+                'by_designation': by_designation,
+                # Precomputed so the API doesn't re-derive them per request
+                'today_designation': by_date.get(today_iso),
+                'tomorrow_designation': by_date.get((now + timedelta(days=1)).date().isoformat()),
                 'summary': {
                     'total_upcoming': len(upcoming_schedule),
-                    'A_count': sum(1 for e in upcoming_schedule if e['designation'] == 'A'),
-                    'B_count': sum(1 for e in upcoming_schedule if e['designation'] == 'B'),
-                    'C_count': sum(1 for e in upcoming_schedule if e['designation'] == 'C')
+                    'A_count': len(by_designation['A']),
+                    'B_count': len(by_designation['B']),
+                    'C_count': len(by_designation['C'])
                 }
             }
             
@@ -189,8 +231,11 @@ class DominionEnergyExtractor:
             print(f"  B: {payload['summary']['B_count']}")
             print(f"  C: {payload['summary']['C_count']}")
             
-            # Publish to API
-            if self.publish_to_api(payload):
+            # Save directly when embedded in the API server, otherwise publish
+            if self.save is not None:
+                if self.save(payload):
+                    print("✓ Data saved in-process")
+            elif self.publish_to_api(payload):
                 print("✓ Data published successfully")
             
             return payload